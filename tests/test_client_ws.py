@@ -2,8 +2,8 @@
 import asyncio
 import base64
 import hashlib
-import os
-from typing import Any
+from types import MappingProxyType, SimpleNamespace
+from typing import Any, AsyncIterator, Mapping, Optional
 from unittest import mock
 
 import pytest
@@ -14,770 +14,483 @@ from aiohttp.http import WS_KEY
 from aiohttp.streams import EofStream
 from aiohttp.test_utils import make_mocked_coro
 
+_UPGRADE = hdrs.UPGRADE
+_CONNECTION = hdrs.CONNECTION
+_SEC_ACCEPT = hdrs.SEC_WEBSOCKET_ACCEPT
+_SEC_PROTO = hdrs.SEC_WEBSOCKET_PROTOCOL
+_SEC_EXT = hdrs.SEC_WEBSOCKET_EXTENSIONS
+_SEC_KEY = hdrs.SEC_WEBSOCKET_KEY
+_ORIGIN = hdrs.ORIGIN
+
+# The tests never rely on the key being random, a constant lets
+# the expected Sec-WebSocket-Accept value be computed once.
+_KEY_DATA = b"\x00" * 16
+
+
+def _ws_accept(key: bytes) -> str:
+    return base64.b64encode(hashlib.sha1(key + WS_KEY).digest()).decode()
+
+
+_WS_ACCEPT = _ws_accept(base64.b64encode(_KEY_DATA))
+
+_OK_HEADERS = MappingProxyType(
+    {
+        _UPGRADE: "websocket",
+        _CONNECTION: "upgrade",
+        _SEC_ACCEPT: _WS_ACCEPT,
+        _SEC_PROTO: "chat",
+    }
+)
+
+
+def _handshake_headers(overrides: Mapping[str, str]) -> Mapping[str, str]:
+    return MappingProxyType({**_OK_HEADERS, **overrides})
+
+
+class _FakeResp:
+    # Plain stand-in for ClientResponse carrying only what the
+    # handshake reads, much cheaper to build than a Mock.
+    __slots__ = ("status", "headers", "connection", "request_info", "history", "close")
+
+    def __init__(self, status: int, headers: Optional[Mapping[str, str]] = None):
+        self.status = status
+        self.headers = {} if headers is None else headers
+        self.connection = mock.Mock()
+        self.request_info = None
+        self.history = ()
+        self.close = lambda: None
+
 
 @pytest.fixture
-def key_data():
-    return os.urandom(16)
+def patched_client_os(monkeypatch: Any) -> None:
+    # aiohttp.client only uses os.urandom, replace its reference to
+    # the module so the real os.urandom stays untouched.
+    monkeypatch.setattr(client, "os", SimpleNamespace(urandom=lambda n: _KEY_DATA))
 
 
 @pytest.fixture
-def key(key_data: Any):
-    return base64.b64encode(key_data)
+async def session(loop: Any) -> AsyncIterator[aiohttp.ClientSession]:
+    session = aiohttp.ClientSession()
+    yield session
+    await session.close()
 
 
 @pytest.fixture
-def ws_key(key: Any):
-    return base64.b64encode(hashlib.sha1(key + WS_KEY).digest()).decode()
+def ws_writer(monkeypatch: Any) -> mock.Mock:
+    writer = mock.Mock()
+    writer.close = make_mocked_coro()
+    writer.send = make_mocked_coro()
+    monkeypatch.setattr("aiohttp.client.WebSocketWriter", lambda *args, **kw: writer)
+    return writer
 
 
-async def test_ws_connect(ws_key: Any, loop: Any, key_data: Any) -> None:
-    resp = mock.Mock()
-    resp.status = 101
-    resp.headers = {
-        hdrs.UPGRADE: "websocket",
-        hdrs.CONNECTION: "upgrade",
-        hdrs.SEC_WEBSOCKET_ACCEPT: ws_key,
-        hdrs.SEC_WEBSOCKET_PROTOCOL: "chat",
-    }
-    with mock.patch("aiohttp.client.os") as m_os:
-        with mock.patch("aiohttp.client.ClientSession.request") as m_req:
-            m_os.urandom.return_value = key_data
-            m_req.return_value = loop.create_future()
-            m_req.return_value.set_result(resp)
+@pytest.fixture
+def ws_request(monkeypatch: Any) -> mock.Mock:
+    # Records the arguments of ClientSession.request() and returns
+    # its return_value to the awaiting handshake code.
+    calls = mock.Mock()
+
+    async def fake_request(self, *args, **kwargs):
+        return calls(*args, **kwargs)
 
-            res = await aiohttp.ClientSession().ws_connect(
-                "http://test.org", protocols=("t1", "t2", "chat")
-            )
+    monkeypatch.setattr("aiohttp.client.ClientSession.request", fake_request)
+    return calls
+
+
+@pytest.mark.usefixtures("patched_client_os")
+async def test_ws_connect(ws_request: Any, session: Any) -> None:
+    resp = _FakeResp(101, _OK_HEADERS)
+    ws_request.return_value = resp
+
+    res = await session.ws_connect("http://test.org", protocols=("t1", "t2", "chat"))
 
     assert isinstance(res, client.ClientWebSocketResponse)
     assert res.protocol == "chat"
-    assert hdrs.ORIGIN not in m_req.call_args[1]["headers"]
+    assert _ORIGIN not in ws_request.call_args[1]["headers"]
 
 
-async def test_try_ws_connect_upgrade(loop: Any, ws_key: Any, key_data: Any) -> None:
-    resp = mock.Mock()
-    resp.status = 101
-    resp.headers = {
-        hdrs.UPGRADE: "websocket",
-        hdrs.CONNECTION: "upgrade",
-        hdrs.SEC_WEBSOCKET_ACCEPT: ws_key,
-        hdrs.SEC_WEBSOCKET_PROTOCOL: "chat",
-    }
-    with mock.patch("aiohttp.client.os") as m_os:
-        with mock.patch("aiohttp.client.ClientSession.request") as m_req:
-            m_os.urandom.return_value = key_data
-            m_req.return_value = loop.create_future()
-            m_req.return_value.set_result(resp)
+@pytest.mark.usefixtures("patched_client_os")
+async def test_try_ws_connect_upgrade(ws_request: Any, session: Any) -> None:
+    resp = _FakeResp(101, _OK_HEADERS)
+    ws_request.return_value = resp
 
-            try_res = await aiohttp.ClientSession().try_ws_connect(
-                "http://test.org", protocols=("t1", "t2", "chat")
-            )
-            res = try_res.upgrade()
+    try_res = await session.try_ws_connect(
+        "http://test.org", protocols=("t1", "t2", "chat")
+    )
+    res = try_res.upgrade()
 
     assert isinstance(res, client.ClientWebSocketResponse)
     assert res.protocol == "chat"
-    assert hdrs.ORIGIN not in m_req.call_args[1]["headers"]
+    assert _ORIGIN not in ws_request.call_args[1]["headers"]
 
 
-async def test_ws_connect_with_origin(key_data: Any, loop: Any) -> None:
-    resp = mock.Mock()
-    resp.status = 403
-    with mock.patch("aiohttp.client.os") as m_os:
-        with mock.patch("aiohttp.client.ClientSession.request") as m_req:
-            m_os.urandom.return_value = key_data
-            m_req.return_value = loop.create_future()
-            m_req.return_value.set_result(resp)
+async def test_ws_connect_with_origin(ws_request: Any, session: Any) -> None:
+    resp = _FakeResp(403)
+    ws_request.return_value = resp
 
-            origin = "https://example.org/page.html"
-            with pytest.raises(client.WSServerHandshakeError):
-                await aiohttp.ClientSession().ws_connect(
-                    "http://test.org", origin=origin
-                )
+    origin = "https://example.org/page.html"
+    with pytest.raises(client.WSServerHandshakeError):
+        await session.ws_connect("http://test.org", origin=origin)
 
-    assert hdrs.ORIGIN in m_req.call_args[1]["headers"]
-    assert m_req.call_args[1]["headers"][hdrs.ORIGIN] == origin
+    assert _ORIGIN in ws_request.call_args[1]["headers"]
+    assert ws_request.call_args[1]["headers"][_ORIGIN] == origin
 
 
-async def test_ws_connect_with_params(ws_key: Any, loop: Any, key_data: Any) -> None:
-    params = {"key1": "value1", "key2": "value2"}
-
-    resp = mock.Mock()
-    resp.status = 101
-    resp.headers = {
-        hdrs.UPGRADE: "websocket",
-        hdrs.CONNECTION: "upgrade",
-        hdrs.SEC_WEBSOCKET_ACCEPT: ws_key,
-        hdrs.SEC_WEBSOCKET_PROTOCOL: "chat",
-    }
-    with mock.patch("aiohttp.client.os") as m_os:
-        with mock.patch("aiohttp.client.ClientSession.request") as m_req:
-            m_os.urandom.return_value = key_data
-            m_req.return_value = loop.create_future()
-            m_req.return_value.set_result(resp)
+async def test_ws_connect_with_params(ws_request: Any, session: Any) -> None:
+    # Only the request arguments are checked, a rejected
+    # handshake spares the upgrade of the connection.
+    ws_request.return_value = _FakeResp(403)
 
-            await aiohttp.ClientSession().ws_connect(
-                "http://test.org", protocols=("t1", "t2", "chat"), params=params
-            )
+    params = {"key1": "value1", "key2": "value2"}
+    with pytest.raises(client.WSServerHandshakeError):
+        await session.ws_connect(
+            "http://test.org", protocols=("t1", "t2", "chat"), params=params
+        )
 
-    assert m_req.call_args[1]["params"] == params
+    assert ws_request.call_args[1]["params"] == params
 
 
-async def test_ws_connect_custom_response(
-    loop: Any, ws_key: Any, key_data: Any
-) -> None:
+@pytest.mark.usefixtures("loop", "patched_client_os")
+async def test_ws_connect_custom_response(ws_request: Any) -> None:
     class CustomResponse(client.ClientWebSocketResponse):
         def read(self, decode=False):
             return "customized!"
 
-    resp = mock.Mock()
-    resp.status = 101
-    resp.headers = {
-        hdrs.UPGRADE: "websocket",
-        hdrs.CONNECTION: "upgrade",
-        hdrs.SEC_WEBSOCKET_ACCEPT: ws_key,
-    }
-    with mock.patch("aiohttp.client.os") as m_os:
-        with mock.patch("aiohttp.client.ClientSession.request") as m_req:
-            m_os.urandom.return_value = key_data
-            m_req.return_value = loop.create_future()
-            m_req.return_value.set_result(resp)
+    resp = _FakeResp(101, _OK_HEADERS)
+    ws_request.return_value = resp
 
-            res = await aiohttp.ClientSession(
-                ws_response_class=CustomResponse
-            ).ws_connect("http://test.org")
+    async with aiohttp.ClientSession(ws_response_class=CustomResponse) as session:
+        res = await session.ws_connect("http://test.org")
 
     assert res.read() == "customized!"
 
 
-async def test_try_ws_connect_err_access_to_resp(
-    loop: Any, ws_key: Any, key_data: Any
+@pytest.mark.usefixtures("patched_client_os")
+async def test_try_ws_connect_err_access_to_resp(ws_request: Any, session: Any) -> None:
+    resp = _FakeResp(500, _OK_HEADERS)
+    ws_request.return_value = resp
+
+    async with session.try_ws_connect(
+        "http://test.org", protocols=("t1", "t2", "chat")
+    ) as ws_handshake:
+        assert ws_handshake.error
+        assert ws_handshake.error_response is resp
+
+
+@pytest.mark.usefixtures("patched_client_os")
+@pytest.mark.parametrize(
+    ("status", "headers", "compress", "message"),
+    [
+        pytest.param(500, _OK_HEADERS, 0, "Invalid response status", id="status"),
+        pytest.param(
+            101,
+            _handshake_headers({_UPGRADE: "test"}),
+            0,
+            "Invalid upgrade header",
+            id="upgrade",
+        ),
+        pytest.param(
+            101,
+            _handshake_headers({_CONNECTION: "close"}),
+            0,
+            "Invalid connection header",
+            id="connection",
+        ),
+        pytest.param(
+            101,
+            _handshake_headers({_SEC_ACCEPT: "asdfasdfasdfasdfasdfasdf"}),
+            0,
+            "Invalid challenge response",
+            id="challenge",
+        ),
+        pytest.param(
+            101,
+            _handshake_headers(
+                {_SEC_EXT: "permessage-deflate; client_max_window_bits=6"}
+            ),
+            15,
+            "Invalid window size",
+            id="deflate-client-wbits",
+        ),
+        pytest.param(
+            101,
+            _handshake_headers({_SEC_EXT: "permessage-deflate; bad"}),
+            15,
+            "Extension for deflate not supported; bad",
+            id="deflate-server-ext",
+        ),
+    ],
+)
+async def test_ws_connect_handshake_err(
+    status: Any,
+    headers: Any,
+    compress: Any,
+    message: Any,
+    ws_request: Any,
+    session: Any,
 ) -> None:
-    resp = mock.Mock()
-    resp.status = 500
-    resp.headers = {
-        hdrs.UPGRADE: "websocket",
-        hdrs.CONNECTION: "upgrade",
-        hdrs.SEC_WEBSOCKET_ACCEPT: ws_key,
-    }
-    with mock.patch("aiohttp.client.os") as m_os:
-        with mock.patch("aiohttp.client.ClientSession.request") as m_req:
-            m_os.urandom.return_value = key_data
-            m_req.return_value = loop.create_future()
-            m_req.return_value.set_result(resp)
-
-            async with aiohttp.ClientSession().try_ws_connect(
-                "http://test.org", protocols=("t1", "t2", "chat")
-            ) as ws_handshake:
-                assert ws_handshake.error
-                assert ws_handshake.error_response is resp
-
-
-async def test_ws_connect_err_status(loop: Any, ws_key: Any, key_data: Any) -> None:
-    resp = mock.Mock()
-    resp.status = 500
-    resp.headers = {
-        hdrs.UPGRADE: "websocket",
-        hdrs.CONNECTION: "upgrade",
-        hdrs.SEC_WEBSOCKET_ACCEPT: ws_key,
-    }
-    with mock.patch("aiohttp.client.os") as m_os:
-        with mock.patch("aiohttp.client.ClientSession.request") as m_req:
-            m_os.urandom.return_value = key_data
-            m_req.return_value = loop.create_future()
-            m_req.return_value.set_result(resp)
-
-            with pytest.raises(client.WSServerHandshakeError) as ctx:
-                await aiohttp.ClientSession().ws_connect(
-                    "http://test.org", protocols=("t1", "t2", "chat")
-                )
-
-    assert ctx.value.message == "Invalid response status"
-
-
-async def test_ws_connect_err_upgrade(loop: Any, ws_key: Any, key_data: Any) -> None:
-    resp = mock.Mock()
-    resp.status = 101
-    resp.headers = {
-        hdrs.UPGRADE: "test",
-        hdrs.CONNECTION: "upgrade",
-        hdrs.SEC_WEBSOCKET_ACCEPT: ws_key,
-    }
-    with mock.patch("aiohttp.client.os") as m_os:
-        with mock.patch("aiohttp.client.ClientSession.request") as m_req:
-            m_os.urandom.return_value = key_data
-            m_req.return_value = loop.create_future()
-            m_req.return_value.set_result(resp)
-
-            with pytest.raises(client.WSServerHandshakeError) as ctx:
-                await aiohttp.ClientSession().ws_connect(
-                    "http://test.org", protocols=("t1", "t2", "chat")
-                )
-
-    assert ctx.value.message == "Invalid upgrade header"
-
-
-async def test_ws_connect_err_conn(loop: Any, ws_key: Any, key_data: Any) -> None:
-    resp = mock.Mock()
-    resp.status = 101
-    resp.headers = {
-        hdrs.UPGRADE: "websocket",
-        hdrs.CONNECTION: "close",
-        hdrs.SEC_WEBSOCKET_ACCEPT: ws_key,
-    }
-    with mock.patch("aiohttp.client.os") as m_os:
-        with mock.patch("aiohttp.client.ClientSession.request") as m_req:
-            m_os.urandom.return_value = key_data
-            m_req.return_value = loop.create_future()
-            m_req.return_value.set_result(resp)
-
-            with pytest.raises(client.WSServerHandshakeError) as ctx:
-                await aiohttp.ClientSession().ws_connect(
-                    "http://test.org", protocols=("t1", "t2", "chat")
-                )
-
-    assert ctx.value.message == "Invalid connection header"
-
-
-async def test_ws_connect_err_challenge(loop: Any, ws_key: Any, key_data: Any) -> None:
-    resp = mock.Mock()
-    resp.status = 101
-    resp.headers = {
-        hdrs.UPGRADE: "websocket",
-        hdrs.CONNECTION: "upgrade",
-        hdrs.SEC_WEBSOCKET_ACCEPT: "asdfasdfasdfasdfasdfasdf",
-    }
-    with mock.patch("aiohttp.client.os") as m_os:
-        with mock.patch("aiohttp.client.ClientSession.request") as m_req:
-            m_os.urandom.return_value = key_data
-            m_req.return_value = loop.create_future()
-            m_req.return_value.set_result(resp)
+    resp = _FakeResp(status, headers)
+    resp.close = mock.Mock()
+    ws_request.return_value = resp
 
-            with pytest.raises(client.WSServerHandshakeError) as ctx:
-                await aiohttp.ClientSession().ws_connect(
-                    "http://test.org", protocols=("t1", "t2", "chat")
-                )
+    with pytest.raises(client.WSServerHandshakeError) as ctx:
+        await session.ws_connect(
+            "http://test.org", protocols=("t1", "t2", "chat"), compress=compress
+        )
 
-    assert ctx.value.message == "Invalid challenge response"
+    assert ctx.value.message == message
+    resp.close.assert_called_with()
 
 
-async def test_ws_connect_common_headers(ws_key: Any, loop: Any, key_data: Any) -> None:
+async def test_ws_connect_common_headers(
+    monkeypatch: Any, ws_request: Any, session: Any
+) -> None:
     # Emulate a headers dict being reused for a second ws_connect.
 
     # In this scenario, we need to ensure that the newly generated secret key
     # is sent to the server, not the stale key.
     headers = {}
+    key_data = _KEY_DATA
+    monkeypatch.setattr(client, "os", SimpleNamespace(urandom=lambda n: key_data))
+
+    def mock_get(*args, **kwargs):
+        key = kwargs.get("headers").get(_SEC_KEY)
+        return _FakeResp(
+            101, _handshake_headers({_SEC_ACCEPT: _ws_accept(key.encode("ascii"))})
+        )
+
+    ws_request.side_effect = mock_get
 
     async def test_connection() -> None:
-        async def mock_get(*args, **kwargs):
-            resp = mock.Mock()
-            resp.status = 101
-            key = kwargs.get("headers").get(hdrs.SEC_WEBSOCKET_KEY)
-            accept = base64.b64encode(
-                hashlib.sha1(base64.b64encode(base64.b64decode(key)) + WS_KEY).digest()
-            ).decode()
-            resp.headers = {
-                hdrs.UPGRADE: "websocket",
-                hdrs.CONNECTION: "upgrade",
-                hdrs.SEC_WEBSOCKET_ACCEPT: accept,
-                hdrs.SEC_WEBSOCKET_PROTOCOL: "chat",
-            }
-            return resp
-
-        with mock.patch("aiohttp.client.os") as m_os:
-            with mock.patch(
-                "aiohttp.client.ClientSession.request", side_effect=mock_get
-            ) as m_req:
-                m_os.urandom.return_value = key_data
-
-                res = await aiohttp.ClientSession().ws_connect(
-                    "http://test.org", protocols=("t1", "t2", "chat"), headers=headers
-                )
+        res = await session.ws_connect(
+            "http://test.org", protocols=("t1", "t2", "chat"), headers=headers
+        )
 
         assert isinstance(res, client.ClientWebSocketResponse)
         assert res.protocol == "chat"
-        assert hdrs.ORIGIN not in m_req.call_args[1]["headers"]
+        assert _ORIGIN not in ws_request.call_args[1]["headers"]
 
     await test_connection()
     # Generate a new ws key
-    key_data = os.urandom(16)
+    key_data = b"\x01" * 16
     await test_connection()
 
 
-async def test_close(loop: Any, ws_key: Any, key_data: Any) -> None:
-    resp = mock.Mock()
-    resp.status = 101
-    resp.headers = {
-        hdrs.UPGRADE: "websocket",
-        hdrs.CONNECTION: "upgrade",
-        hdrs.SEC_WEBSOCKET_ACCEPT: ws_key,
-    }
-    with mock.patch("aiohttp.client.WebSocketWriter") as WebSocketWriter:
-        with mock.patch("aiohttp.client.os") as m_os:
-            with mock.patch("aiohttp.client.ClientSession.request") as m_req:
-                m_os.urandom.return_value = key_data
-                m_req.return_value = loop.create_future()
-                m_req.return_value.set_result(resp)
-                writer = mock.Mock()
-                WebSocketWriter.return_value = writer
-                writer.close = make_mocked_coro()
-
-                session = aiohttp.ClientSession()
-                resp = await session.ws_connect("http://test.org")
-                assert not resp.closed
-
-                resp._reader.feed_data(
-                    aiohttp.WSMessage(aiohttp.WSMsgType.CLOSE, b"", b""), 0
-                )
-
-                res = await resp.close()
-                writer.close.assert_called_with(1000, b"")
-                assert resp.closed
-                assert res
-                assert resp.exception() is None
-
-                # idempotent
-                res = await resp.close()
-                assert not res
-                assert writer.close.call_count == 1
-
-                await session.close()
-
-
-async def test_close_eofstream(loop: Any, ws_key: Any, key_data: Any) -> None:
-    resp = mock.Mock()
-    resp.status = 101
-    resp.headers = {
-        hdrs.UPGRADE: "websocket",
-        hdrs.CONNECTION: "upgrade",
-        hdrs.SEC_WEBSOCKET_ACCEPT: ws_key,
-    }
-    with mock.patch("aiohttp.client.WebSocketWriter") as WebSocketWriter:
-        with mock.patch("aiohttp.client.os") as m_os:
-            with mock.patch("aiohttp.client.ClientSession.request") as m_req:
-                m_os.urandom.return_value = key_data
-                m_req.return_value = loop.create_future()
-                m_req.return_value.set_result(resp)
-                writer = WebSocketWriter.return_value = mock.Mock()
-
-                session = aiohttp.ClientSession()
-                resp = await session.ws_connect("http://test.org")
-                assert not resp.closed
-
-                exc = EofStream()
-                resp._reader.set_exception(exc)
-
-                await resp.receive()
-                writer.close.assert_called_with(1000, b"")
-                assert resp.closed
-
-                await session.close()
-
-
-async def test_close_exc(loop: Any, ws_key: Any, key_data: Any) -> None:
-    resp = mock.Mock()
-    resp.status = 101
-    resp.headers = {
-        hdrs.UPGRADE: "websocket",
-        hdrs.CONNECTION: "upgrade",
-        hdrs.SEC_WEBSOCKET_ACCEPT: ws_key,
-    }
-    with mock.patch("aiohttp.client.WebSocketWriter") as WebSocketWriter:
-        with mock.patch("aiohttp.client.os") as m_os:
-            with mock.patch("aiohttp.client.ClientSession.request") as m_req:
-                m_os.urandom.return_value = key_data
-                m_req.return_value = loop.create_future()
-                m_req.return_value.set_result(resp)
-                writer = mock.Mock()
-                WebSocketWriter.return_value = writer
-                writer.close = make_mocked_coro()
-
-                session = aiohttp.ClientSession()
-                resp = await session.ws_connect("http://test.org")
-                assert not resp.closed
-
-                exc = ValueError()
-                resp._reader.set_exception(exc)
-
-                await resp.close()
-                assert resp.closed
-                assert resp.exception() is exc
-
-                await session.close()
-
-
-async def test_close_exc2(loop: Any, ws_key: Any, key_data: Any) -> None:
-    resp = mock.Mock()
-    resp.status = 101
-    resp.headers = {
-        hdrs.UPGRADE: "websocket",
-        hdrs.CONNECTION: "upgrade",
-        hdrs.SEC_WEBSOCKET_ACCEPT: ws_key,
-    }
-    with mock.patch("aiohttp.client.WebSocketWriter") as WebSocketWriter:
-        with mock.patch("aiohttp.client.os") as m_os:
-            with mock.patch("aiohttp.client.ClientSession.request") as m_req:
-                m_os.urandom.return_value = key_data
-                m_req.return_value = loop.create_future()
-                m_req.return_value.set_result(resp)
-                writer = WebSocketWriter.return_value = mock.Mock()
-
-                resp = await aiohttp.ClientSession().ws_connect("http://test.org")
-                assert not resp.closed
-
-                exc = ValueError()
-                writer.close.side_effect = exc
-
-                await resp.close()
-                assert resp.closed
-                assert resp.exception() is exc
-
-                resp._closed = False
-                writer.close.side_effect = asyncio.CancelledError()
-                with pytest.raises(asyncio.CancelledError):
-                    await resp.close()
-
-
-async def test_send_data_after_close(ws_key: Any, key_data: Any, loop: Any) -> None:
-    resp = mock.Mock()
-    resp.status = 101
-    resp.headers = {
-        hdrs.UPGRADE: "websocket",
-        hdrs.CONNECTION: "upgrade",
-        hdrs.SEC_WEBSOCKET_ACCEPT: ws_key,
-    }
-    with mock.patch("aiohttp.client.os") as m_os:
-        with mock.patch("aiohttp.client.ClientSession.request") as m_req:
-            m_os.urandom.return_value = key_data
-            m_req.return_value = loop.create_future()
-            m_req.return_value.set_result(resp)
-
-            resp = await aiohttp.ClientSession().ws_connect("http://test.org")
-            resp._writer._closing = True
-
-            for meth, args in (
-                (resp.ping, ()),
-                (resp.pong, ()),
-                (resp.send_str, ("s",)),
-                (resp.send_bytes, (b"b",)),
-                (resp.send_json, ({},)),
-            ):
-                with pytest.raises(ConnectionResetError):
-                    await meth(*args)
-
-
-async def test_send_data_type_errors(ws_key: Any, key_data: Any, loop: Any) -> None:
-    resp = mock.Mock()
-    resp.status = 101
-    resp.headers = {
-        hdrs.UPGRADE: "websocket",
-        hdrs.CONNECTION: "upgrade",
-        hdrs.SEC_WEBSOCKET_ACCEPT: ws_key,
-    }
-    with mock.patch("aiohttp.client.WebSocketWriter") as WebSocketWriter:
-        with mock.patch("aiohttp.client.os") as m_os:
-            with mock.patch("aiohttp.client.ClientSession.request") as m_req:
-                m_os.urandom.return_value = key_data
-                m_req.return_value = loop.create_future()
-                m_req.return_value.set_result(resp)
-                WebSocketWriter.return_value = mock.Mock()
-
-                resp = await aiohttp.ClientSession().ws_connect("http://test.org")
-
-                with pytest.raises(TypeError):
-                    await resp.send_str(b"s")
-                with pytest.raises(TypeError):
-                    await resp.send_bytes("b")
-                with pytest.raises(TypeError):
-                    await resp.send_json(set())
-
-
-async def test_reader_read_exception(ws_key: Any, key_data: Any, loop: Any) -> None:
-    hresp = mock.Mock()
-    hresp.status = 101
-    hresp.headers = {
-        hdrs.UPGRADE: "websocket",
-        hdrs.CONNECTION: "upgrade",
-        hdrs.SEC_WEBSOCKET_ACCEPT: ws_key,
-    }
-    with mock.patch("aiohttp.client.WebSocketWriter") as WebSocketWriter:
-        with mock.patch("aiohttp.client.os") as m_os:
-            with mock.patch("aiohttp.client.ClientSession.request") as m_req:
-                m_os.urandom.return_value = key_data
-                m_req.return_value = loop.create_future()
-                m_req.return_value.set_result(hresp)
+@pytest.mark.usefixtures("patched_client_os")
+async def test_close(ws_request: Any, ws_writer: Any, session: Any) -> None:
+    ws_request.return_value = _FakeResp(101, _OK_HEADERS)
 
-                writer = mock.Mock()
-                WebSocketWriter.return_value = writer
-                writer.close = make_mocked_coro()
+    resp = await session.ws_connect("http://test.org")
+    assert not resp.closed
 
-                session = aiohttp.ClientSession()
-                resp = await session.ws_connect("http://test.org")
+    resp._reader.feed_data(aiohttp.WSMessage(aiohttp.WSMsgType.CLOSE, b"", b""), 0)
 
-                exc = ValueError()
-                resp._reader.set_exception(exc)
+    res = await resp.close()
+    ws_writer.close.assert_called_with(1000, b"")
+    assert resp.closed
+    assert res
+    assert resp.exception() is None
 
-                msg = await resp.receive()
-                assert msg.type == aiohttp.WSMsgType.ERROR
-                assert resp.exception() is exc
+    # idempotent
+    res = await resp.close()
+    assert not res
+    assert ws_writer.close.call_count == 1
 
-                await session.close()
 
+@pytest.mark.usefixtures("patched_client_os")
+async def test_close_eofstream(ws_request: Any, ws_writer: Any, session: Any) -> None:
+    ws_request.return_value = _FakeResp(101, _OK_HEADERS)
 
-async def test_receive_runtime_err(loop: Any) -> None:
-    resp = client.ClientWebSocketResponse(
-        mock.Mock(), mock.Mock(), mock.Mock(), mock.Mock(), 10.0, True, True, loop
-    )
-    resp._waiting = True
+    resp = await session.ws_connect("http://test.org")
+    assert not resp.closed
 
-    with pytest.raises(RuntimeError):
-        await resp.receive()
+    resp._reader.set_exception(EofStream())
 
+    await resp.receive()
+    ws_writer.close.assert_called_with(1000, b"")
+    assert resp.closed
 
-async def test_ws_connect_close_resp_on_err(
-    loop: Any, ws_key: Any, key_data: Any
-) -> None:
-    resp = mock.Mock()
-    resp.status = 500
-    resp.headers = {
-        hdrs.UPGRADE: "websocket",
-        hdrs.CONNECTION: "upgrade",
-        hdrs.SEC_WEBSOCKET_ACCEPT: ws_key,
-    }
-    with mock.patch("aiohttp.client.os") as m_os:
-        with mock.patch("aiohttp.client.ClientSession.request") as m_req:
-            m_os.urandom.return_value = key_data
-            m_req.return_value = loop.create_future()
-            m_req.return_value.set_result(resp)
 
-            with pytest.raises(client.WSServerHandshakeError):
-                await aiohttp.ClientSession().ws_connect(
-                    "http://test.org", protocols=("t1", "t2", "chat")
-                )
-            resp.close.assert_called_with()
+@pytest.mark.usefixtures("patched_client_os", "ws_writer")
+async def test_close_exc(ws_request: Any, session: Any) -> None:
+    ws_request.return_value = _FakeResp(101, _OK_HEADERS)
 
+    resp = await session.ws_connect("http://test.org")
+    assert not resp.closed
 
-async def test_ws_connect_non_overlapped_protocols(
-    ws_key: Any, loop: Any, key_data: Any
-) -> None:
-    resp = mock.Mock()
-    resp.status = 101
-    resp.headers = {
-        hdrs.UPGRADE: "websocket",
-        hdrs.CONNECTION: "upgrade",
-        hdrs.SEC_WEBSOCKET_ACCEPT: ws_key,
-        hdrs.SEC_WEBSOCKET_PROTOCOL: "other,another",
-    }
-    with mock.patch("aiohttp.client.os") as m_os:
-        with mock.patch("aiohttp.client.ClientSession.request") as m_req:
-            m_os.urandom.return_value = key_data
-            m_req.return_value = loop.create_future()
-            m_req.return_value.set_result(resp)
+    exc = ValueError()
+    resp._reader.set_exception(exc)
 
-            res = await aiohttp.ClientSession().ws_connect(
-                "http://test.org", protocols=("t1", "t2", "chat")
-            )
+    await resp.close()
+    assert resp.closed
+    assert resp.exception() is exc
 
-    assert res.protocol is None
 
+@pytest.mark.usefixtures("patched_client_os")
+async def test_close_exc2(ws_request: Any, ws_writer: Any, session: Any) -> None:
+    ws_request.return_value = _FakeResp(101, _OK_HEADERS)
 
-async def test_ws_connect_non_overlapped_protocols_2(
-    ws_key: Any, loop: Any, key_data: Any
-) -> None:
-    resp = mock.Mock()
-    resp.status = 101
-    resp.headers = {
-        hdrs.UPGRADE: "websocket",
-        hdrs.CONNECTION: "upgrade",
-        hdrs.SEC_WEBSOCKET_ACCEPT: ws_key,
-        hdrs.SEC_WEBSOCKET_PROTOCOL: "other,another",
-    }
-    with mock.patch("aiohttp.client.os") as m_os:
-        with mock.patch("aiohttp.client.ClientSession.request") as m_req:
-            m_os.urandom.return_value = key_data
-            m_req.return_value = loop.create_future()
-            m_req.return_value.set_result(resp)
+    resp = await session.ws_connect("http://test.org")
+    assert not resp.closed
 
-            connector = aiohttp.TCPConnector(force_close=True)
-            res = await aiohttp.ClientSession(connector=connector).ws_connect(
-                "http://test.org", protocols=("t1", "t2", "chat")
-            )
+    exc = ValueError()
+    ws_writer.close.side_effect = exc
 
-    assert res.protocol is None
-    del res
+    await resp.close()
+    assert resp.closed
+    assert resp.exception() is exc
 
+    resp._closed = False
+    ws_writer.close.side_effect = asyncio.CancelledError()
+    with pytest.raises(asyncio.CancelledError):
+        await resp.close()
 
-async def test_ws_connect_deflate(loop: Any, ws_key: Any, key_data: Any) -> None:
-    resp = mock.Mock()
-    resp.status = 101
-    resp.headers = {
-        hdrs.UPGRADE: "websocket",
-        hdrs.CONNECTION: "upgrade",
-        hdrs.SEC_WEBSOCKET_ACCEPT: ws_key,
-        hdrs.SEC_WEBSOCKET_EXTENSIONS: "permessage-deflate",
-    }
-    with mock.patch("aiohttp.client.os") as m_os:
-        with mock.patch("aiohttp.client.ClientSession.request") as m_req:
-            m_os.urandom.return_value = key_data
-            m_req.return_value = loop.create_future()
-            m_req.return_value.set_result(resp)
 
-            res = await aiohttp.ClientSession().ws_connect(
-                "http://test.org", compress=15
-            )
+@pytest.mark.usefixtures("patched_client_os")
+async def test_send_data_after_close(ws_request: Any, session: Any) -> None:
+    resp = _FakeResp(101, _OK_HEADERS)
+    ws_request.return_value = resp
 
-    assert res.compress == 15
-    assert res.client_notakeover is False
+    resp = await session.ws_connect("http://test.org")
+    resp._writer._closing = True
 
+    for meth, args in (
+        (resp.ping, ()),
+        (resp.pong, ()),
+        (resp.send_str, ("s",)),
+        (resp.send_bytes, (b"b",)),
+        (resp.send_json, ({},)),
+    ):
+        with pytest.raises(ConnectionResetError):
+            await meth(*args)
 
-async def test_ws_connect_deflate_per_message(
-    loop: Any, ws_key: Any, key_data: Any
-) -> None:
-    resp = mock.Mock()
-    resp.status = 101
-    resp.headers = {
-        hdrs.UPGRADE: "websocket",
-        hdrs.CONNECTION: "upgrade",
-        hdrs.SEC_WEBSOCKET_ACCEPT: ws_key,
-        hdrs.SEC_WEBSOCKET_EXTENSIONS: "permessage-deflate",
-    }
-    with mock.patch("aiohttp.client.WebSocketWriter") as WebSocketWriter:
-        with mock.patch("aiohttp.client.os") as m_os:
-            with mock.patch("aiohttp.client.ClientSession.request") as m_req:
-                m_os.urandom.return_value = key_data
-                m_req.return_value = loop.create_future()
-                m_req.return_value.set_result(resp)
-                writer = WebSocketWriter.return_value = mock.Mock()
-                send = writer.send = make_mocked_coro()
 
-                session = aiohttp.ClientSession()
-                resp = await session.ws_connect("http://test.org")
+@pytest.mark.usefixtures("patched_client_os", "ws_writer")
+async def test_send_data_type_errors(ws_request: Any, session: Any) -> None:
+    ws_request.return_value = _FakeResp(101, _OK_HEADERS)
 
-                await resp.send_str("string", compress=-1)
-                send.assert_called_with("string", binary=False, compress=-1)
+    resp = await session.ws_connect("http://test.org")
 
-                await resp.send_bytes(b"bytes", compress=15)
-                send.assert_called_with(b"bytes", binary=True, compress=15)
+    with pytest.raises(TypeError):
+        await resp.send_str(b"s")
+    with pytest.raises(TypeError):
+        await resp.send_bytes("b")
+    with pytest.raises(TypeError):
+        await resp.send_json(set())
 
-                await resp.send_json([{}], compress=-9)
-                send.assert_called_with("[{}]", binary=False, compress=-9)
 
-                await session.close()
+@pytest.mark.usefixtures("patched_client_os", "ws_writer")
+async def test_reader_read_exception(ws_request: Any, session: Any) -> None:
+    ws_request.return_value = _FakeResp(101, _OK_HEADERS)
 
+    resp = await session.ws_connect("http://test.org")
 
-async def test_ws_connect_deflate_server_not_support(
-    loop: Any, ws_key: Any, key_data: Any
-) -> None:
-    resp = mock.Mock()
-    resp.status = 101
-    resp.headers = {
-        hdrs.UPGRADE: "websocket",
-        hdrs.CONNECTION: "upgrade",
-        hdrs.SEC_WEBSOCKET_ACCEPT: ws_key,
-    }
-    with mock.patch("aiohttp.client.os") as m_os:
-        with mock.patch("aiohttp.client.ClientSession.request") as m_req:
-            m_os.urandom.return_value = key_data
-            m_req.return_value = loop.create_future()
-            m_req.return_value.set_result(resp)
+    exc = ValueError()
+    resp._reader.set_exception(exc)
 
-            res = await aiohttp.ClientSession().ws_connect(
-                "http://test.org", compress=15
-            )
+    msg = await resp.receive()
+    assert msg.type == aiohttp.WSMsgType.ERROR
+    assert resp.exception() is exc
 
-    assert res.compress == 0
-    assert res.client_notakeover is False
+
+async def test_receive_runtime_err(loop: Any) -> None:
+    # receive() raises before touching the reader or the writer,
+    # only the response is read by the constructor.
+    resp = client.ClientWebSocketResponse(
+        None, None, None, _FakeResp(101), 10.0, True, True, loop
+    )
+    resp._waiting = True
+
+    with pytest.raises(RuntimeError):
+        await resp.receive()
 
 
-async def test_ws_connect_deflate_notakeover(
-    loop: Any, ws_key: Any, key_data: Any
+@pytest.mark.usefixtures("patched_client_os")
+async def test_ws_connect_non_overlapped_protocols(
+    ws_request: Any, session: Any
 ) -> None:
-    resp = mock.Mock()
-    resp.status = 101
-    resp.headers = {
-        hdrs.UPGRADE: "websocket",
-        hdrs.CONNECTION: "upgrade",
-        hdrs.SEC_WEBSOCKET_ACCEPT: ws_key,
-        hdrs.SEC_WEBSOCKET_EXTENSIONS: "permessage-deflate; "
-        "client_no_context_takeover",
-    }
-    with mock.patch("aiohttp.client.os") as m_os:
-        with mock.patch("aiohttp.client.ClientSession.request") as m_req:
-            m_os.urandom.return_value = key_data
-            m_req.return_value = loop.create_future()
-            m_req.return_value.set_result(resp)
+    resp = _FakeResp(101, _handshake_headers({_SEC_PROTO: "other,another"}))
+    ws_request.return_value = resp
 
-            res = await aiohttp.ClientSession().ws_connect(
-                "http://test.org", compress=15
-            )
+    res = await session.ws_connect("http://test.org", protocols=("t1", "t2", "chat"))
 
-    assert res.compress == 15
-    assert res.client_notakeover is True
+    assert res.protocol is None
 
 
-async def test_ws_connect_deflate_client_wbits(
-    loop: Any, ws_key: Any, key_data: Any
-) -> None:
-    resp = mock.Mock()
-    resp.status = 101
-    resp.headers = {
-        hdrs.UPGRADE: "websocket",
-        hdrs.CONNECTION: "upgrade",
-        hdrs.SEC_WEBSOCKET_ACCEPT: ws_key,
-        hdrs.SEC_WEBSOCKET_EXTENSIONS: "permessage-deflate; "
-        "client_max_window_bits=10",
-    }
-    with mock.patch("aiohttp.client.os") as m_os:
-        with mock.patch("aiohttp.client.ClientSession.request") as m_req:
-            m_os.urandom.return_value = key_data
-            m_req.return_value = loop.create_future()
-            m_req.return_value.set_result(resp)
+@pytest.mark.usefixtures("loop", "patched_client_os")
+async def test_ws_connect_non_overlapped_protocols_2(ws_request: Any) -> None:
+    resp = _FakeResp(101, _handshake_headers({_SEC_PROTO: "other,another"}))
+    ws_request.return_value = resp
 
-            res = await aiohttp.ClientSession().ws_connect(
-                "http://test.org", compress=15
-            )
+    connector = aiohttp.TCPConnector(force_close=True)
+    async with aiohttp.ClientSession(connector=connector) as session:
+        res = await session.ws_connect(
+            "http://test.org", protocols=("t1", "t2", "chat")
+        )
 
-    assert res.compress == 10
-    assert res.client_notakeover is False
+    assert res.protocol is None
+    del res
 
 
-async def test_ws_connect_deflate_client_wbits_bad(
-    loop: Any, ws_key: Any, key_data: Any
+@pytest.mark.usefixtures("patched_client_os")
+@pytest.mark.parametrize(
+    ("headers", "compress", "client_notakeover"),
+    [
+        pytest.param(_OK_HEADERS, 0, False, id="server-not-support"),
+        pytest.param(
+            _handshake_headers({_SEC_EXT: "permessage-deflate"}),
+            15,
+            False,
+            id="deflate",
+        ),
+        pytest.param(
+            _handshake_headers(
+                {_SEC_EXT: "permessage-deflate; client_no_context_takeover"}
+            ),
+            15,
+            True,
+            id="notakeover",
+        ),
+        pytest.param(
+            _handshake_headers(
+                {_SEC_EXT: "permessage-deflate; client_max_window_bits=10"}
+            ),
+            10,
+            False,
+            id="client-wbits",
+        ),
+    ],
+)
+async def test_ws_connect_deflate(
+    headers: Any,
+    compress: Any,
+    client_notakeover: Any,
+    ws_request: Any,
+    session: Any,
 ) -> None:
-    resp = mock.Mock()
-    resp.status = 101
-    resp.headers = {
-        hdrs.UPGRADE: "websocket",
-        hdrs.CONNECTION: "upgrade",
-        hdrs.SEC_WEBSOCKET_ACCEPT: ws_key,
-        hdrs.SEC_WEBSOCKET_EXTENSIONS: "permessage-deflate; "
-        "client_max_window_bits=6",
-    }
-    with mock.patch("aiohttp.client.os") as m_os:
-        with mock.patch("aiohttp.client.ClientSession.request") as m_req:
-            m_os.urandom.return_value = key_data
-            m_req.return_value = loop.create_future()
-            m_req.return_value.set_result(resp)
+    ws_request.return_value = _FakeResp(101, headers)
 
-            with pytest.raises(client.WSServerHandshakeError):
-                await aiohttp.ClientSession().ws_connect("http://test.org", compress=15)
+    res = await session.ws_connect("http://test.org", compress=15)
 
+    assert res.compress == compress
+    assert res.client_notakeover is client_notakeover
 
-async def test_ws_connect_deflate_server_ext_bad(
-    loop: Any, ws_key: Any, key_data: Any
+
+@pytest.mark.usefixtures("patched_client_os")
+async def test_ws_connect_deflate_per_message(
+    ws_request: Any, ws_writer: Any, session: Any
 ) -> None:
-    resp = mock.Mock()
-    resp.status = 101
-    resp.headers = {
-        hdrs.UPGRADE: "websocket",
-        hdrs.CONNECTION: "upgrade",
-        hdrs.SEC_WEBSOCKET_ACCEPT: ws_key,
-        hdrs.SEC_WEBSOCKET_EXTENSIONS: "permessage-deflate; bad",
-    }
-    with mock.patch("aiohttp.client.os") as m_os:
-        with mock.patch("aiohttp.client.ClientSession.request") as m_req:
-            m_os.urandom.return_value = key_data
-            m_req.return_value = loop.create_future()
-            m_req.return_value.set_result(resp)
-
-            with pytest.raises(client.WSServerHandshakeError):
-                await aiohttp.ClientSession().ws_connect("http://test.org", compress=15)
+    ws_request.return_value = _FakeResp(
+        101, _handshake_headers({_SEC_EXT: "permessage-deflate"})
+    )
+
+    resp = await session.ws_connect("http://test.org")
+
+    await resp.send_str("string", compress=-1)
+    ws_writer.send.assert_called_with("string", binary=False, compress=-1)
+
+    await resp.send_bytes(b"bytes", compress=15)
+    ws_writer.send.assert_called_with(b"bytes", binary=True, compress=15)
+
+    await resp.send_json([{}], compress=-9)
+    ws_writer.send.assert_called_with("[{}]", binary=False, compress=-9)